@@ -1,35 +1,154 @@
 import boto3
-import json
+from botocore.config import Config
+import orjson
 import uuid
 import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from kinesis_records import decode
 stream_name = 'twitter-stream'
 
-kinesis_client = boto3.client('kinesis', region_name='eu-west-2')
+# The JSON log format doesn't use thread or process info, skip collecting it
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 
-# iterator
 
-# shard id
-# describe the stream
-stream_description = kinesis_client.describe_stream(StreamName=stream_name)
-print(f'\n{stream_description}')
-# get the shard ID
-shard_id = stream_description['StreamDescription']['Shards'][0]['ShardId']
-print(f' \nShard ID: {shard_id}')
+class JsonFormatter(logging.Formatter):
+    """Formats each log record as one JSON object per line"""
 
-# get iterator
-shard_iterator = kinesis_client.get_shard_iterator(
-    StreamName=stream_name,
-    ShardId=shard_id,
-    ShardIteratorType='TRIM_HORIZON'
+    def format(self, record):
+        entry = {
+            'timestamp': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return orjson.dumps(entry).decode()
+
+
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(JsonFormatter())
+logging.basicConfig(level=logging.INFO, handlers=[log_handler])
+logger = logging.getLogger(__name__)
+
+# Enhanced fan-out consumer; records are pushed over a long-lived
+# SubscribeToShard connection instead of polled with GetRecords
+consumer_name = 'twitter-stream-reader'
+# SubscribeToShard may be called once per second per shard and consumer
+RESUBSCRIBE_DELAY = 1
+
+# Readers hold one connection per shard; the pool grows to the shard count
+MIN_POOL_CONNECTIONS = 50
+
+# Set when one reader fails, so the others stop too
+stop_reading = threading.Event()
+
+# Keep connections alive and pooled so calls reuse the same TLS session
+client_config = Config(
+    tcp_keepalive=True,
+    max_pool_connections=MIN_POOL_CONNECTIONS,
+    retries={'mode': 'standard', 'max_attempts': 5}
 )
 
-# iterator hash 
-shard_iterator_key = shard_iterator['ShardIterator']
+kinesis_client = boto3.client('kinesis', region_name='eu-west-2', config=client_config)
+
+
+def list_shard_ids():
+    """Returns the ID of every shard in the stream"""
+    paginator = kinesis_client.get_paginator('list_shards')
+    return [
+        shard['ShardId']
+        for page in paginator.paginate(StreamName=stream_name)
+        for shard in page['Shards']
+    ]
+
+
+def register_consumer():
+    """Registers the fan-out consumer if needed, returns its ARN once active"""
+    stream_arn = kinesis_client.describe_stream_summary(
+        StreamName=stream_name
+    )['StreamDescriptionSummary']['StreamARN']
+    try:
+        consumer = kinesis_client.register_stream_consumer(
+            StreamARN=stream_arn,
+            ConsumerName=consumer_name
+        )['Consumer']
+    except kinesis_client.exceptions.ResourceInUseException:
+        # already registered by an earlier run
+        consumer = kinesis_client.describe_stream_consumer(
+            StreamARN=stream_arn,
+            ConsumerName=consumer_name
+        )['ConsumerDescription']
+
+    while consumer['ConsumerStatus'] != 'ACTIVE':
+        time.sleep(1)
+        consumer = kinesis_client.describe_stream_consumer(
+            ConsumerARN=consumer['ConsumerARN']
+        )['ConsumerDescription']
+    return consumer['ConsumerARN']
+
+
+def read_shard(consumer_arn, shard_id):
+    """Streams one shard from the oldest record until the shard is closed"""
+    starting_position = {'Type': 'TRIM_HORIZON'}
+
+    # Each subscription lasts up to 5 minutes, then we resume where it ended
+    while starting_position and not stop_reading.is_set():
+        try:
+            subscription = kinesis_client.subscribe_to_shard(
+                ConsumerARN=consumer_arn,
+                ShardId=shard_id,
+                StartingPosition=starting_position
+            )
+        except kinesis_client.exceptions.ResourceInUseException:
+            # the previous subscription hasn't been released yet
+            time.sleep(RESUBSCRIBE_DELAY)
+            continue
+
+        for event in subscription['EventStream']:
+            # events arrive at least every few seconds, even with no records
+            if stop_reading.is_set():
+                return
+            shard_event = event['SubscribeToShardEvent']
+            for record in shard_event['Records']:
+                for data in decode(record['Data']):
+                    logger.info('%s: %s', shard_id, data)
+
+            # no continuation sequence number means the shard is closed
+            sequence_number = shard_event.get('ContinuationSequenceNumber')
+            if sequence_number is None:
+                starting_position = None
+            else:
+                starting_position = {
+                    'Type': 'AFTER_SEQUENCE_NUMBER',
+                    'SequenceNumber': sequence_number
+                }
+
+
+consumer_arn = register_consumer()
+shard_ids = list_shard_ids()
+logger.info('Shard IDs: %s', shard_ids)
 
-# data required to work this
-record_response = kinesis_client.get_records(ShardIterator=shard_iterator_key, Limit=2)
+if len(shard_ids) > MIN_POOL_CONNECTIONS:
+    client_config = client_config.merge(Config(max_pool_connections=len(shard_ids)))
+    kinesis_client = boto3.client('kinesis', region_name='eu-west-2', config=client_config)
 
-while 'NextShardIterator' in record_response:
-    record_response = kinesis_client.get_records(ShardIterator=record_response['NextShardIterator'])
-    print(f'\n \n {record_response}')
-    time.sleep(5)
\ No newline at end of file
+# One reader per shard; they all share kinesis_client, which is thread-safe
+executor = ThreadPoolExecutor(max_workers=len(shard_ids))
+readers = {
+    executor.submit(read_shard, consumer_arn, shard_id): shard_id
+    for shard_id in shard_ids
+}
+# Returns once every shard is closed, or as soon as one reader fails
+done, _ = wait(readers, return_when=FIRST_EXCEPTION)
+failed = [reader for reader in done if reader.exception() is not None]
+if failed:
+    logger.error('Reader for %s failed, stopping the others', readers[failed[0]])
+    stop_reading.set()
+executor.shutdown()
+if failed:
+    raise failed[0].exception()
@@ -0,0 +1,126 @@
+import hashlib
+import threading
+import zstandard
+
+# KPL aggregated record layout:
+#   magic | protobuf AggregatedRecord | md5(protobuf)
+# See https://github.com/awslabs/amazon-kinesis-producer/blob/master/aggregation-format.md
+KPL_MAGIC = b'\xf3\x89\x9a\xc2'
+DIGEST_SIZE = 16
+
+# KPL's default AggregationMaxSize
+MAX_AGGREGATED_BYTES = 51200
+
+# Marks zstd-compressed data. Neither JSON nor KPL records start with it,
+# so uncompressed records from other producers still decode.
+ZSTD_PREFIX = b'\x01'
+ZSTD_LEVEL = 1
+
+# zstd (de)compressors must not be shared between threads
+_zstd = threading.local()
+
+# protobuf wire types
+VARINT = 0
+LENGTH_DELIMITED = 2
+
+
+def _varint(value):
+    """Encodes an unsigned int as a protobuf varint"""
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number, payload):
+    """Encodes a length-delimited protobuf field"""
+    return _varint(number << 3 | LENGTH_DELIMITED) + _varint(len(payload)) + payload
+
+
+def _read_varint(buf, pos):
+    """Decodes a protobuf varint, returns (value, next position)"""
+    value = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _read_fields(buf):
+    """Yields (field number, value) for each field of a protobuf message"""
+    pos = 0
+    while pos < len(buf):
+        key, pos = _read_varint(buf, pos)
+        number, wire_type = key >> 3, key & 0x7
+        if wire_type == VARINT:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == LENGTH_DELIMITED:
+            size, pos = _read_varint(buf, pos)
+            value, pos = buf[pos:pos + size], pos + size
+        else:
+            raise ValueError(f'Unsupported protobuf wire type {wire_type}')
+        yield number, value
+
+
+def aggregated_size(partition_key, data):
+    """Upper bound on the bytes one user record adds to an aggregate"""
+    # key + data, plus field keys, lengths and the key index
+    return len(partition_key) + len(data) + 16
+
+
+def aggregate(records):
+    """Packs (partition_key, data) pairs into one KPL aggregated record"""
+    key_table = {}
+    body = bytearray()
+    for partition_key, data in records:
+        key_index = key_table.setdefault(partition_key, len(key_table))
+        record = (_varint(1 << 3 | VARINT) + _varint(key_index)
+                  + _field(3, data))
+        body += _field(3, record)
+    message = b''.join(_field(1, key.encode()) for key in key_table) + body
+    return KPL_MAGIC + message + hashlib.md5(message).digest()
+
+
+def deaggregate(data):
+    """Unpacks a Kinesis record's data into the user records it carries"""
+    message = data[len(KPL_MAGIC):-DIGEST_SIZE]
+    if (len(data) < len(KPL_MAGIC) + DIGEST_SIZE
+            or not data.startswith(KPL_MAGIC)
+            or hashlib.md5(message).digest() != data[-DIGEST_SIZE:]):
+        # Not aggregated, the record is a single user record
+        return [data]
+    return [
+        value
+        for number, record in _read_fields(message) if number == 3
+        for field, value in _read_fields(record) if field == 3
+    ]
+
+
+def compress(data):
+    """Zstd-compresses record data, unless that doesn't make it smaller"""
+    if not hasattr(_zstd, 'compressor'):
+        _zstd.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    compressed = ZSTD_PREFIX + _zstd.compressor.compress(data)
+    return compressed if len(compressed) < len(data) else data
+
+
+def decompress(data):
+    """Reverses compress, uncompressed data is returned as-is"""
+    if not data.startswith(ZSTD_PREFIX):
+        return data
+    if not hasattr(_zstd, 'decompressor'):
+        _zstd.decompressor = zstandard.ZstdDecompressor()
+    return _zstd.decompressor.decompress(data[len(ZSTD_PREFIX):])
+
+
+def decode(data):
+    """Decompresses and deaggregates a Kinesis record's data"""
+    return deaggregate(decompress(data))
@@ -1,10 +1,54 @@
 import boto3
-import json
-import uuid
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+import orjson
 import time
+import random
+import atexit
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from kinesis_records import aggregate, aggregated_size, compress, MAX_AGGREGATED_BYTES
 stream_name = 'twitter-stream'
 
-kinesis_client = boto3.client('kinesis', region_name='eu-west-2')
+logger = logging.getLogger(__name__)
+
+# put_records limits per request
+MAX_BATCH_RECORDS = 500
+MAX_BATCH_BYTES = 5 * 1024 * 1024
+# data plus partition key of a single record
+MAX_RECORD_BYTES = 1024 * 1024
+# Retry delays before jitter: 0.2, 0.4, 0.8, then capped at 1s
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.1
+MAX_BACKOFF = 1.0
+# put_records calls in flight at once, must not exceed max_pool_connections
+MAX_CONCURRENT_BATCHES = 8
+
+# Buffered producer: the background thread flushes once any limit is hit
+FLUSH_MAX_BYTES = 4900000
+FLUSH_MAX_RECORDS = 500
+FLUSH_INTERVAL = 1.0
+# Flushes an entry gets before it is dropped
+MAX_FLUSH_ATTEMPTS = 5
+# Error codes that can succeed on a later flush; 5xx responses are retried too
+RETRYABLE_ERROR_CODES = {
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'KMSThrottlingException',
+    'InternalFailure',
+    'ServiceUnavailable',
+}
+
+# Keep connections alive and pooled so calls reuse the same TLS session
+client_config = Config(
+    tcp_keepalive=True,
+    max_pool_connections=50,
+    retries={'mode': 'standard', 'max_attempts': 5}
+)
+
+kinesis_client = boto3.client('kinesis', region_name='eu-west-2', config=client_config)
 records = [
     {
         'age': 29, 
@@ -25,16 +69,311 @@ records = [
     }
 ]
 
-partition_key = str(uuid.uuid4())
 
+# 64 random bits as hex
+RANDOM_KEY_BYTES = 16
+
+
+def random_partition_key():
+    """Spreads records across shards, no need for a crypto-grade uuid4"""
+    return format(random.getrandbits(64), '016x')
 
-def put_to_stream(records, partition_key): 
-    for record in records:
-        put_response = kinesis_client.put_record(
+
+def entry_size(entry):
+    """Bytes a put_records entry counts against the record and batch limits"""
+    return len(entry['Data']) + len(entry['PartitionKey'].encode())
+
+
+def batches(entries):
+    """Splits put_records entries into batches within the request limits"""
+    batch, batch_bytes = [], 0
+    for entry in entries:
+        entry_bytes = entry_size(entry)
+        if batch and (len(batch) == MAX_BATCH_RECORDS
+                      or batch_bytes + entry_bytes > MAX_BATCH_BYTES):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(entry)
+        batch_bytes += entry_bytes
+    if batch:
+        yield batch
+
+
+def put_batch(batch):
+    """Writes one batch, retrying only the entries Kinesis rejected"""
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            # Full jitter keeps concurrent writers from retrying in lockstep
+            delay = min(BACKOFF_BASE * 2 ** attempt, MAX_BACKOFF)
+            time.sleep(random.uniform(0, delay))
+        put_response = kinesis_client.put_records(
             StreamName=stream_name,
-            Data=json.dumps(record)
-            PartitionKey=partition_key
+            Records=batch
+        )
+        if put_response['FailedRecordCount'] == 0:
+            return []
+        batch = [
+            entry for entry, result in zip(batch, put_response['Records'])
+            if 'ErrorCode' in result
+        ]
+    return batch
+
+
+def aggregated_entries(user_records):
+    """Packs (partition_key, data) pairs into as few put_records entries as fit
+
+    Only records with the same partition_key share an entry, since Kinesis
+    routes the entry by that one key. Records keyed None share entries
+    with each other and go to any shard.
+    """
+    groups = {}     # partition_key -> [records, bytes]
+    for partition_key, data in user_records:
+        size = aggregated_size(partition_key or '', data)
+        group = groups.get(partition_key)
+        if group and group[1] + size > MAX_AGGREGATED_BYTES:
+            yield aggregated_entry(partition_key, group[0])
+            group = None
+        if group is None:
+            group = groups[partition_key] = [[], 0]
+        group[0].append((partition_key, data))
+        group[1] += size
+    for partition_key, (group, _) in groups.items():
+        yield aggregated_entry(partition_key, group)
+
+
+def aggregated_entry(partition_key, group):
+    """Builds one put_records entry from records sharing partition_key"""
+    # Keyless records get one random key per entry, which routes the entry
+    # and keeps the KPL key table (and the compressed data) small
+    partition_key = partition_key or random_partition_key()
+    if len(group) > 1:
+        data = aggregate([(partition_key, user_data) for _, user_data in group])
+    else:
+        data = group[0][1]
+    return {'Data': compress(data), 'PartitionKey': partition_key}
+
+
+def put_entries(entries):
+    """Writes put_records entries, returns the ones that still failed
+
+    Entries over MAX_RECORD_BYTES are never sent, they are returned as failed.
+    A single one would make Kinesis reject its whole batch.
+    """
+    sendable, oversized = [], []
+    for entry in entries:
+        if entry_size(entry) > MAX_RECORD_BYTES:
+            oversized.append(entry)
+        else:
+            sendable.append(entry)
+    # Batches are sent concurrently, so records in different batches
+    # are not guaranteed to land in order
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_BATCHES) as executor:
+        results = executor.map(put_batch, batches(sendable))
+        return oversized + [entry for failed in results for entry in failed]
+
+
+def put_to_stream(records, partition_key=None): 
+    """Writes records to the stream, returns the entries that still failed
+
+    Without a partition_key each put_records entry gets a random key.
+    """
+    # Many small records ride in one aggregated Kinesis record, so the
+    # 1000 records/s shard limit stops being the bottleneck
+    return put_entries(aggregated_entries(
+        (partition_key, orjson.dumps(record)) for record in records
+    ))
+
+
+# Buffered producer state, guarded by buffer_condition
+buffer = deque()            # (partition_key, data) waiting to be sent
+buffer_bytes = 0
+buffer_started = None       # time.monotonic() of the oldest buffered record
+unsent_entries = []         # (entry, attempts) a previous flush couldn't write
+retry_at = None             # time.monotonic() when unsent_entries are retried
+flush_requested = False     # set by flush() to send without waiting for a limit
+flushes_started = 0
+flushes_done = 0
+stopping = False
+flush_thread = None
+buffer_condition = threading.Condition()
+
+
+def enqueue(record, partition_key=None):
+    """Buffers a record for the background flush thread and returns at once
+
+    Without a partition_key the record goes out under the random key
+    of whichever put_records entry it is aggregated into. Raises ValueError
+    for a record Kinesis could never accept.
+    """
+    global buffer_bytes, buffer_started, flush_thread
+    data = orjson.dumps(record)
+    key_bytes = len(partition_key.encode()) if partition_key else RANDOM_KEY_BYTES
+    if len(data) + key_bytes > MAX_RECORD_BYTES:
+        raise ValueError(f'Record is {len(data) + key_bytes} bytes with its key, '
+                         f'over the {MAX_RECORD_BYTES} byte Kinesis limit')
+    with buffer_condition:
+        # flush_and_join may have just stopped the thread
+        if flush_thread is None or not flush_thread.is_alive():
+            flush_thread = threading.Thread(target=flush_loop, daemon=True)
+            flush_thread.start()
+        if not buffer:
+            buffer_started = time.monotonic()
+        buffer.append((partition_key, data))
+        buffer_bytes += len(data)
+        # Wake the thread on the first record too, so it starts the age timer
+        if len(buffer) == 1 or flush_due():
+            buffer_condition.notify_all()
+
+
+def flush_due():
+    """Whether the buffer hit a size, count or age limit, or a retry is due
+
+    Call with buffer_condition held.
+    """
+    now = time.monotonic()
+    if flush_requested or unsent_entries and now >= retry_at:
+        return True
+    return bool(buffer) and (
+        buffer_bytes >= FLUSH_MAX_BYTES
+        or len(buffer) >= FLUSH_MAX_RECORDS
+        or now - buffer_started >= FLUSH_INTERVAL
+    )
+
+
+def take_flush():
+    """Waits until a flush is due, then pops the records and retries to send"""
+    global buffer_bytes, buffer_started, unsent_entries
+    global flush_requested, flushes_started
+    with buffer_condition:
+        while not (stopping or flush_due()):
+            deadlines = []
+            if buffer:
+                deadlines.append(buffer_started + FLUSH_INTERVAL)
+            if unsent_entries:
+                deadlines.append(retry_at)
+            timeout = min(deadlines) - time.monotonic() if deadlines else None
+            buffer_condition.wait(timeout)
+
+        user_records, taken_bytes = [], 0
+        while (buffer and len(user_records) < FLUSH_MAX_RECORDS
+               and taken_bytes < FLUSH_MAX_BYTES):
+            user_record = buffer.popleft()
+            user_records.append(user_record)
+            taken_bytes += len(user_record[1])
+        buffer_bytes -= taken_bytes
+        buffer_started = time.monotonic() if buffer else None
+        if not buffer:
+            flush_requested = False
+        flushes_started += 1
+
+        retries, unsent_entries = unsent_entries, []
+        return user_records, retries
+
+
+def retryable(error):
+    """Whether a put_records call that raised error can succeed later"""
+    if isinstance(error, ClientError):
+        code = error.response.get('Error', {}).get('Code')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return code in RETRYABLE_ERROR_CODES or status >= 500
+    return isinstance(error, (BotoConnectionError, HTTPClientError, ConnectionError))
+
+
+def send_flush(user_records, retries):
+    """Sends one flush, returns the (entry, attempts) worth another flush"""
+    attempts = {id(entry): count for entry, count in retries}
+    entries = [entry for entry, _ in retries] + list(aggregated_entries(user_records))
+    failed, dropped = [], 0
+    # Sent from this thread: concurrent.futures refuses new work once
+    # the interpreter is shutting down, which is when atexit flushes
+    for batch in batches(entries):
+        try:
+            rejected = put_batch(batch)
+        except Exception as error:
+            # Never let an error kill this thread, that would strand the buffer
+            if not retryable(error):
+                logger.exception('Dropping %d entries, put_records failed for good', len(batch))
+                continue
+            logger.warning('Writing %d entries failed, retrying later: %r', len(batch), error)
+            rejected = batch
+        for entry in rejected:
+            count = attempts.get(id(entry), 0) + 1
+            if count < MAX_FLUSH_ATTEMPTS:
+                failed.append((entry, count))
+            else:
+                dropped += 1
+    if dropped:
+        logger.error('Dropping %d entries after %d flush attempts', dropped, MAX_FLUSH_ATTEMPTS)
+    if failed:
+        logger.warning('%d entries not written, retrying on a later flush', len(failed))
+    return failed
+
+
+def flush_loop():
+    """Background thread: sends buffered records until stopped and drained"""
+    global unsent_entries, retry_at, flushes_done, flush_thread
+    while True:
+        user_records, retries = take_flush()
+        failed = []
+        if user_records or retries:
+            failed = send_flush(user_records, retries)
+        with buffer_condition:
+            # Failed entries go back in front of the next flush
+            unsent_entries = failed + unsent_entries
+            if failed:
+                retry_at = time.monotonic() + FLUSH_INTERVAL
+            flushes_done += 1
+            buffer_condition.notify_all()
+            if stopping and not buffer:
+                # Cleared under the lock, so the next enqueue starts a new thread
+                if flush_thread is threading.current_thread():
+                    flush_thread = None
+                return
+
+
+def flush():
+    """Sends everything buffered so far and waits for it, the thread keeps running
+
+    Lambda freezes the process between invocations without running atexit,
+    so call this before a handler returns. Returns how many entries could
+    not be written yet; they stay in unsent_entries for the next flush.
+    """
+    global flush_requested
+    with buffer_condition:
+        if flush_thread is None:
+            return len(unsent_entries)
+        flush_requested = True
+        # The next flush to start takes everything buffered up to now;
+        # wait for it, for any flushes the rest needs, and for none in flight
+        target = flushes_started + 1
+        buffer_condition.notify_all()
+        buffer_condition.wait_for(
+            lambda: not buffer and flushes_done == flushes_started >= target
         )
+        return len(unsent_entries)
+
+
+def flush_and_join():
+    """Flushes whatever is buffered and stops the background thread
+
+    Returns how many entries the last flush could not write. They are left
+    in unsent_entries and are lost if the process exits now. A later
+    enqueue starts a new thread.
+    """
+    global stopping
+    with buffer_condition:
+        stopping = True
+        buffer_condition.notify_all()
+        thread = flush_thread
+    if thread is not None:
+        thread.join()
+    with buffer_condition:
+        stopping = False
+        if unsent_entries:
+            logger.warning('%d entries left unsent after the final flush', len(unsent_entries))
+        return len(unsent_entries)
+
 
-        time.sleep(2)
-    
+# Don't drop buffered records when the process exits. This does not run
+# when Lambda freezes a container, handlers should call flush() instead.
+atexit.register(flush_and_join)
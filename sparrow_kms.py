@@ -1,18 +1,29 @@
 #!/usr/bin/env python
 import boto3
+from botocore.config import Config
 import base64
 import random
-import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 from twython import Twython
 
+# Keep connections alive and pooled so calls reuse the same TLS session
+client_config = Config(
+    tcp_keepalive=True,
+    max_pool_connections=50,
+    retries={'mode': 'standard', 'max_attempts': 5}
+)
+
+# Created once per container so every decrypt reuses the same client
+kms = boto3.client('kms', config=client_config)
+
 # Credentials setup
 # Loads in 'creds.json' values as a dictionary
-with open('creds.json') as f:
-    credentials = json.loads(f.read())
+with open('creds.json', 'rb') as f:
+    credentials = orjson.loads(f.read())
 
 def decrypt(ciphertext):
     """Decrypt ciphertext with KMS""" 
-    kms = boto3.client('kms')
     print('Decrypting ciphertext with KMS')
     plaintext = kms.decrypt(CiphertextBlob = base64.b64decode(ciphertext))['Plaintext']
     return plaintext
@@ -20,26 +31,37 @@ def decrypt(ciphertext):
 # Decrypts API keys and sets config values from the config file
 # Make sure this is loading KMS encrypted values in creds.json 
 # or else you may see a TypeError: Incorrect padding error
-CONSUMER_KEY = decrypt(credentials["consumer_key"])
-CONSUMER_SECRET = decrypt(credentials["consumer_secret"])
-ACCESS_TOKEN_KEY = decrypt(credentials["access_token_key"])
-ACCESS_TOKEN_SECRET = decrypt(credentials["access_token_secret"])
+# The four decrypts run concurrently so they cost one KMS round trip
+credential_keys = ["consumer_key", "consumer_secret",
+                   "access_token_key", "access_token_secret"]
+with ThreadPoolExecutor(max_workers=len(credential_keys)) as executor:
+    (CONSUMER_KEY, CONSUMER_SECRET,
+     ACCESS_TOKEN_KEY, ACCESS_TOKEN_SECRET) = executor.map(
+        decrypt, [credentials[key] for key in credential_keys])
 
 
 
 # Create the Twython Twitter client using our credentials
+# Everything above runs once per Lambda container, so warm invocations
+# of handler reuse the loaded credentials and this client
 twitter = Twython(CONSUMER_KEY, CONSUMER_SECRET,
                   ACCESS_TOKEN_KEY, ACCESS_TOKEN_SECRET)
 
+# Longest status Twitter accepts, in characters
+MAX_TWEET_LENGTH = 280
+
 # Sample random tweets
-potential_tweets = [
+potential_tweets = (
     'This is my first tweet with Sparrow by @AldoOkware - https://github.com/aldookware/sparrow',
     'Wow! Isn\'t Sparrow by @AldoOkware just the coolest! https://github.com/aldookware/sparrow',
     'Jeez! Everyone should learn about AWS Lambda and Twitter Bots from @AldoOkware'
-]
+)
 
 def send_tweet(tweet_text):
     """Sends a tweet to Twitter"""
+    # Reject bad tweets here rather than paying for an API call that fails
+    if not 1 <= len(tweet_text) <= MAX_TWEET_LENGTH:
+        raise ValueError(f'Tweet must be 1-{MAX_TWEET_LENGTH} characters: {tweet_text[:50]!r}')
     twitter.update_status(status = tweet_text)
 
 def handler(event,context):
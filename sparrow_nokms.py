@@ -1,12 +1,12 @@
 #!/usr/bin/env python
 import random
-import json
+import orjson
 from twython import Twython
 
 # Credentials setup
 # Loads in 'creds.json' values as a dictionary
-with open('creds.json') as f:
-    credentials = json.loads(f.read())
+with open('creds.json', 'rb') as f:
+    credentials = orjson.loads(f.read())
 
 # Sets config values from the config file
 CONSUMER_KEY = credentials["consumer_key"]
@@ -15,18 +15,26 @@ ACCESS_TOKEN_KEY = credentials["access_token_key"]
 ACCESS_TOKEN_SECRET = credentials["access_token_secret"]
 
 # Create the Twython Twitter client using our credentials
+# Everything above runs once per Lambda container, so warm invocations
+# of handler reuse the loaded credentials and this client
 twitter = Twython(CONSUMER_KEY, CONSUMER_SECRET,
                   ACCESS_TOKEN_KEY, ACCESS_TOKEN_SECRET)
 
+# Longest status Twitter accepts, in characters
+MAX_TWEET_LENGTH = 280
+
 # Sample random tweets
-potential_tweets = [
+potential_tweets = (
     'This is my first tweet with Sparrow by @AldoOkware - https://github.com/aldookware/sparrow',
     'Wow! Isn\'t Sparrow by @AldoOkware just the coolest! https://github.com/aldookware/sparrow',
     'Jeez! Everyone should learn about AWS Lambda and Twitter Bots from @aldookware'
-]
+)
 
 def send_tweet(tweet_text):
     """Sends a tweet to Twitter"""
+    # Reject bad tweets here rather than paying for an API call that fails
+    if not 1 <= len(tweet_text) <= MAX_TWEET_LENGTH:
+        raise ValueError(f'Tweet must be 1-{MAX_TWEET_LENGTH} characters: {tweet_text[:50]!r}')
     twitter.update_status(status = tweet_text)
 
 def handler(event,context):
@@ -0,0 +1,64 @@
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from kinesis_records import (
+    aggregate, deaggregate, compress, decompress, decode, ZSTD_PREFIX
+)
+
+# aws_kinesis_agg's RecordAggregator output for
+# ('key-a', b'hello'), ('key-b', b'world'), ('key-a', b'!')
+KPL_VECTOR = bytes.fromhex(
+    'f3899ac20a056b65792d610a056b65792d621a0908001a0568656c6c6f1a0908011a05'
+    '776f726c641a0508001a012104d9a7ec1586712faa07d58e8afe641b'
+)
+
+
+def test_aggregate_round_trip_with_several_keys():
+    records = [(f'key-{i % 3}', os.urandom(i * 7)) for i in range(50)]
+
+    assert deaggregate(aggregate(records)) == [data for _, data in records]
+
+
+def test_aggregate_matches_the_kpl_format():
+    records = [('key-a', b'hello'), ('key-b', b'world'), ('key-a', b'!')]
+
+    assert aggregate(records) == KPL_VECTOR
+    assert deaggregate(KPL_VECTOR) == [b'hello', b'world', b'!']
+
+
+def test_deaggregate_passes_plain_records_through():
+    assert deaggregate(b'{"age": 29}') == [b'{"age": 29}']
+
+
+def test_deaggregate_passes_records_with_a_bad_md5_through():
+    corrupted = KPL_VECTOR[:-1] + bytes([KPL_VECTOR[-1] ^ 0xff])
+
+    assert deaggregate(corrupted) == [corrupted]
+
+
+def test_compress_round_trip():
+    data = b'{"age": 29, "stack": "python"}' * 100
+
+    compressed = compress(data)
+
+    assert compressed.startswith(ZSTD_PREFIX)
+    assert len(compressed) < len(data)
+    assert decompress(compressed) == data
+
+
+def test_compress_sends_data_raw_when_not_smaller():
+    data = b'{"i":1}'
+
+    assert compress(data) == data
+    assert decompress(data) == data
+
+
+def test_decode_decompresses_and_deaggregates():
+    records = [('key', b'{"age": 29, "stack": "python"}')] * 100
+    data = compress(aggregate(records))
+
+    assert data.startswith(ZSTD_PREFIX)
+    assert decode(data) == [user_data for _, user_data in records]
@@ -0,0 +1,240 @@
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import orjson
+import pytest
+from botocore.exceptions import ClientError
+
+import kinesis_write
+from kinesis_records import decode
+
+
+def test_buffered_records_are_sent_at_exit():
+    # Exit right after enqueueing, so only the atexit flush can send them
+    script = textwrap.dedent('''
+        import orjson
+        import kinesis_write
+        from kinesis_records import decode
+
+        class FakeKinesis:
+            def put_records(self, StreamName, Records):
+                for entry in Records:
+                    for data in decode(entry['Data']):
+                        print(orjson.loads(data)['i'], flush=True)
+                return {'FailedRecordCount': 0, 'Records': [{} for _ in Records]}
+
+        kinesis_write.kinesis_client = FakeKinesis()
+        for i in range(10):
+            kinesis_write.enqueue({'i': i})
+    ''')
+    result = subprocess.run(
+        [sys.executable, '-c', script],
+        cwd=REPO_ROOT, capture_output=True, text=True, timeout=30
+    )
+    assert result.returncode == 0, result.stderr
+    assert 'Traceback' not in result.stderr
+    assert [int(line) for line in result.stdout.split()] == list(range(10))
+
+
+class FakeKinesis:
+    """Stands in for the boto3 Kinesis client, collects the records put"""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = 0
+        self.sent = []
+
+    def put_records(self, StreamName, Records):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        if any(kinesis_write.entry_size(entry) > kinesis_write.MAX_RECORD_BYTES
+               for entry in Records):
+            raise ValueError('ValidationException: record over 1 MiB')
+        for entry in Records:
+            self.sent.extend(orjson.loads(data)['i'] for data in decode(entry['Data']))
+        return {'FailedRecordCount': 0, 'Records': [{} for _ in Records]}
+
+
+def client_error(code, status):
+    return ClientError(
+        {'Error': {'Code': code, 'Message': code},
+         'ResponseMetadata': {'HTTPStatusCode': status}},
+        'PutRecords'
+    )
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_flush_thread_survives_put_errors(monkeypatch):
+    fake = FakeKinesis(errors=[ConnectionError('connection reset')])
+    monkeypatch.setattr(kinesis_write, 'kinesis_client', fake)
+    monkeypatch.setattr(kinesis_write, 'FLUSH_INTERVAL', 0.05)
+
+    for i in range(5):
+        kinesis_write.enqueue({'i': i})
+    # The first flush fails, its records are kept and retried
+    wait_until(lambda: sorted(fake.sent) == list(range(5)))
+    assert fake.calls >= 2
+    assert kinesis_write.flush_thread.is_alive()
+
+    for i in range(5, 10):
+        kinesis_write.enqueue({'i': i})
+    wait_until(lambda: sorted(fake.sent) == list(range(10)))
+
+
+def test_flush_keeps_the_thread_running(monkeypatch):
+    fake = FakeKinesis()
+    monkeypatch.setattr(kinesis_write, 'kinesis_client', fake)
+
+    # Like two warm Lambda invocations, each flushing before it returns
+    kinesis_write.enqueue({'i': 0})
+    assert kinesis_write.flush() == 0
+    assert fake.sent == [0]
+    kinesis_write.enqueue({'i': 1})
+    assert kinesis_write.flush() == 0
+    assert fake.sent == [0, 1]
+    assert kinesis_write.flush_thread.is_alive()
+
+    # More than one flush worth of records, flush waits for all of them
+    for i in range(2, 1202):
+        kinesis_write.enqueue({'i': i})
+    kinesis_write.flush()
+    assert sorted(fake.sent) == list(range(1202))
+
+
+def test_enqueue_after_flush_and_join_starts_a_new_thread(monkeypatch):
+    fake = FakeKinesis()
+    monkeypatch.setattr(kinesis_write, 'kinesis_client', fake)
+
+    kinesis_write.enqueue({'i': 0})
+    kinesis_write.flush_and_join()
+    assert fake.sent == [0]
+    kinesis_write.enqueue({'i': 1})
+    kinesis_write.flush_and_join()
+    assert fake.sent == [0, 1]
+    assert not kinesis_write.buffer
+
+
+def test_enqueue_replaces_a_flush_thread_that_has_exited(monkeypatch):
+    fake = FakeKinesis()
+    monkeypatch.setattr(kinesis_write, 'kinesis_client', fake)
+    kinesis_write.flush_and_join()
+    # What enqueue sees while flush_and_join is finishing: a dead thread
+    finished = threading.Thread(target=lambda: None)
+    finished.start()
+    finished.join()
+    kinesis_write.flush_thread = finished
+
+    kinesis_write.enqueue({'i': 0})
+    kinesis_write.flush()
+
+    assert fake.sent == [0]
+    assert kinesis_write.flush_thread.is_alive()
+    kinesis_write.flush_and_join()
+
+
+def test_put_to_stream_returns_oversized_entries(monkeypatch):
+    fake = FakeKinesis()
+    monkeypatch.setattr(kinesis_write, 'kinesis_client', fake)
+    # Random bytes don't compress, so this stays over the 1 MiB record limit
+    huge = {'i': -1, 'blob': os.urandom(2 * kinesis_write.MAX_RECORD_BYTES).hex()}
+
+    failed = kinesis_write.put_to_stream([{'i': 0}, huge, {'i': 1}], 'key')
+
+    assert sorted(fake.sent) == [0, 1]
+    assert len(failed) == 1
+    assert kinesis_write.entry_size(failed[0]) > kinesis_write.MAX_RECORD_BYTES
+
+
+def test_aggregated_entries_only_mix_records_with_the_same_key():
+    user_records = [
+        ('a', b'{"i":0}'), (None, b'{"i":1}'), ('b', b'{"i":2}'),
+        ('a', b'{"i":3}'), (None, b'{"i":4}'),
+    ]
+
+    entries = list(kinesis_write.aggregated_entries(user_records))
+
+    by_key = {entry['PartitionKey']: decode(entry['Data']) for entry in entries}
+    assert by_key.pop('a') == [b'{"i":0}', b'{"i":3}']
+    assert by_key.pop('b') == [b'{"i":2}']
+    # The keyless records share one entry under a random key
+    assert list(by_key.values()) == [[b'{"i":1}', b'{"i":4}']]
+
+
+def test_enqueue_rejects_records_over_the_kinesis_limit(monkeypatch):
+    fake = FakeKinesis()
+    monkeypatch.setattr(kinesis_write, 'kinesis_client', fake)
+
+    with pytest.raises(ValueError):
+        kinesis_write.enqueue({'i': -1, 'blob': os.urandom(1536 * 1024).hex()})
+    for i in range(200):
+        kinesis_write.enqueue({'i': i})
+    kinesis_write.flush()
+
+    assert sorted(fake.sent) == list(range(200))
+
+
+def test_client_errors_drop_the_batch_instead_of_retrying(monkeypatch):
+    fake = FakeKinesis(errors=[client_error('AccessDeniedException', 400)])
+    monkeypatch.setattr(kinesis_write, 'kinesis_client', fake)
+    monkeypatch.setattr(kinesis_write, 'FLUSH_INTERVAL', 0.01)
+
+    kinesis_write.enqueue({'i': 0})
+    kinesis_write.flush()
+    assert fake.calls == 1 and not kinesis_write.unsent_entries
+
+    # The thread is still there for the next records
+    kinesis_write.enqueue({'i': 1})
+    kinesis_write.flush()
+    assert fake.sent == [1]
+
+
+def test_retries_stop_after_max_flush_attempts(monkeypatch):
+    throttled = [client_error('ProvisionedThroughputExceededException', 400)] * 100
+    fake = FakeKinesis(errors=throttled)
+    monkeypatch.setattr(kinesis_write, 'kinesis_client', fake)
+    monkeypatch.setattr(kinesis_write, 'FLUSH_INTERVAL', 0.01)
+
+    kinesis_write.enqueue({'i': 0})
+    wait_until(lambda: fake.calls == kinesis_write.MAX_FLUSH_ATTEMPTS
+               and not kinesis_write.unsent_entries)
+    time.sleep(0.1)
+    assert fake.calls == kinesis_write.MAX_FLUSH_ATTEMPTS
+
+
+class RejectingKinesis(FakeKinesis):
+    """Fails every entry with an ErrorCode, like a throttled shard"""
+
+    def put_records(self, StreamName, Records):
+        self.calls += 1
+        return {
+            'FailedRecordCount': len(Records),
+            'Records': [{'ErrorCode': 'ProvisionedThroughputExceededException'}
+                        for _ in Records]
+        }
+
+
+def test_flush_reports_entries_it_could_not_write(monkeypatch, caplog):
+    monkeypatch.setattr(kinesis_write, 'kinesis_client', RejectingKinesis())
+    monkeypatch.setattr(kinesis_write, 'MAX_RETRIES', 0)
+    monkeypatch.setattr(kinesis_write, 'FLUSH_INTERVAL', 60)
+
+    kinesis_write.enqueue({'i': 0})
+
+    assert kinesis_write.flush() == 1
+    assert 'not written' in caplog.text
+    monkeypatch.setattr(kinesis_write, 'kinesis_client', FakeKinesis())
+    assert kinesis_write.flush() == 0